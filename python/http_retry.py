@@ -0,0 +1,81 @@
+"""
+http_retry.py
+-------------
+Retrying GET shared by the detection and enrichment scripts.
+
+Transient failures are retried on the pooled connection, mirroring
+urllib3's Retry(total=5, connect=3, read=3, status=3): waits are drawn
+uniformly from [0, 0.3s * 2**attempt] ("full jitter", capped at 30s), and a
+Retry-After header on 429/503 overrides the computed wait. Once the status
+budget is spent the last response is returned for the caller to inspect.
+"""
+
+import asyncio
+import datetime
+import email.utils
+import logging
+import random
+from typing import Optional
+
+import aiohttp
+
+log = logging.getLogger("http_retry")
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+RETRY_AFTER_STATUSES = frozenset({429, 503})
+RETRY_TOTAL = 5
+RETRY_CONNECT = 3
+RETRY_READ = 3
+RETRY_STATUS = 3
+BACKOFF_FACTOR = 0.3
+BACKOFF_MAX = 30.0
+
+
+def retry_after(resp: aiohttp.ClientResponse) -> Optional[float]:
+    """Seconds requested by a Retry-After header (delta-seconds or HTTP-date)."""
+    value = resp.headers.get("Retry-After")
+    if value is None or resp.status not in RETRY_AFTER_STATUSES:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:  # "-0000" parses naive; RFC 9110 dates are UTC
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return max((when - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0.0)
+
+
+async def get_with_retry(session: aiohttp.ClientSession, url: str, **kwargs) -> aiohttp.ClientResponse:
+    """
+    GET with retries on connection errors, timeouts and retryable statuses.
+    The caller releases the response. Errors while the body is being read
+    after the headers arrive are not retried here.
+    """
+    budget = {"connect": RETRY_CONNECT, "read": RETRY_READ, "status": RETRY_STATUS}
+    for attempt in range(RETRY_TOTAL + 1):
+        try:
+            resp = await session.get(url, **kwargs)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            kind = "connect" if isinstance(e, aiohttp.ClientConnectorError) else "read"
+            if attempt == RETRY_TOTAL or not budget[kind]:
+                raise
+            budget[kind] -= 1
+            wait = None
+        else:
+            if resp.status not in RETRY_STATUSES or attempt == RETRY_TOTAL or not budget["status"]:
+                return resp
+            budget["status"] -= 1
+            wait = retry_after(resp)
+            resp.release()
+
+        if wait is None:
+            delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_FACTOR * 2 ** attempt))
+        else:
+            delay = min(wait, BACKOFF_MAX)
+        # query strings may carry credentials, so only the path is logged
+        log.debug("Retrying GET %s in %.2fs (attempt %d)", url.partition("?")[0], delay, attempt + 1)
+        await asyncio.sleep(delay)
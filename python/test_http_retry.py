@@ -0,0 +1,84 @@
+import asyncio
+import datetime
+import email.utils
+import types
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import http_retry
+
+
+def _serve(monkeypatch, responses):
+    """
+    Run get_with_retry against a server replaying ``responses`` in order.
+    Backoff sleeps are recorded instead of waited out.
+    """
+    hits, delays = [], []
+    real_sleep = asyncio.sleep
+
+    async def sleep(delay):
+        delays.append(delay)
+        await real_sleep(0)
+
+    async def handler(request):
+        status, headers = responses[min(len(hits), len(responses) - 1)]
+        hits.append(status)
+        return web.Response(status=status, headers=headers)
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/", handler)
+        async with TestServer(app) as server, aiohttp.ClientSession() as session:
+            monkeypatch.setattr(http_retry.asyncio, "sleep", sleep)
+            resp = await http_retry.get_with_retry(session, str(server.make_url("/")))
+            monkeypatch.undo()
+            resp.release()
+            return resp.status
+
+    return asyncio.run(run()), hits, delays
+
+
+def test_retries_until_success_honouring_retry_after(monkeypatch):
+    status, hits, delays = _serve(monkeypatch, [
+        (429, {"Retry-After": "2"}),
+        (503, {"Retry-After": "120"}),
+        (502, {}),
+        (200, {}),
+    ])
+    assert status == 200
+    assert hits == [429, 503, 502, 200]
+    assert delays[:2] == [2.0, http_retry.BACKOFF_MAX]
+    assert 0 <= delays[2] <= http_retry.BACKOFF_FACTOR * 2 ** 2
+
+
+def test_returns_last_response_once_status_budget_is_spent(monkeypatch):
+    status, hits, delays = _serve(monkeypatch, [(503, {})])
+    assert status == 503
+    assert len(hits) == http_retry.RETRY_STATUS + 1
+    assert len(delays) == http_retry.RETRY_STATUS
+
+
+def test_client_errors_are_not_retried(monkeypatch):
+    status, hits, delays = _serve(monkeypatch, [(404, {}), (200, {})])
+    assert status == 404
+    assert hits == [404]
+    assert delays == []
+
+
+def _response(status, retry_after):
+    return types.SimpleNamespace(status=status, headers={"Retry-After": retry_after})
+
+
+def test_retry_after_accepts_http_dates():
+    later = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=60)
+    for date in (email.utils.format_datetime(later, usegmt=True),
+                 later.strftime("%a, %d %b %Y %H:%M:%S -0000")):
+        assert 55 <= http_retry.retry_after(_response(503, date)) <= 60
+
+
+def test_retry_after_ignores_bad_values_and_other_statuses():
+    assert http_retry.retry_after(_response(503, "soon")) is None
+    assert http_retry.retry_after(_response(500, "5")) is None
+    assert http_retry.retry_after(_response(429, "-3")) == 0.0